@@ -0,0 +1,118 @@
+import asyncio, base64, logging, os, sqlite3, threading
+from functools import wraps
+import aiohttp
+import orjson
+from cachetools import TTLCache
+from diskcache import Cache, Timeout
+
+log = logging.getLogger(__name__)
+
+API_URL = "https://wolf.qqdl.site"
+
+# Search results keyed by (function name, normalized query). Entries also persist on disk for
+# SEARCH_DISK_TTL, so catalog changes can take up to a day to show up
+_search_cache = TTLCache(maxsize=256, ttl=300)
+# Decoded stream URLs keyed by track id; manifests carry signed URLs, so keep them short-lived
+_url_cache = TTLCache(maxsize=256, ttl=600)
+# Persistent layer under both caches so a fresh launch can answer repeat lookups without the network.
+# Opened on first use, and only ever touched from worker threads (see _disk_call).
+_disk = None
+_disk_lock = threading.Lock()
+SEARCH_DISK_TTL = 86400
+
+# Caps in-flight requests across searches and prefetches so bursts don't trip the API's rate limit
+_net_sem = asyncio.Semaphore(4)
+
+# What a failed request or an unexpected response body can raise (orjson.JSONDecodeError is a ValueError;
+# a null where an object was expected gives TypeError, an empty "urls" list IndexError)
+API_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError, KeyError, ValueError, TypeError, IndexError)
+
+def create_session():
+    # One pooled session for all requests so keep-alive reuses the TLS connection
+    connector = aiohttp.TCPConnector(limit=8, limit_per_host=4, keepalive_timeout=30)
+    timeout = aiohttp.ClientTimeout(total=10, sock_connect=3)
+    headers = {"Accept-Encoding": "gzip"}
+    # raise_for_status turns 4xx/5xx into ClientResponseError instead of a confusing KeyError on the body
+    return aiohttp.ClientSession(connector=connector, timeout=timeout, headers=headers, raise_for_status=True)
+
+async def close_session(session: aiohttp.ClientSession):
+    if session and not session.closed:
+        await session.close()
+
+def _disk_cache():
+    global _disk
+    with _disk_lock:
+        if _disk is None:
+            _disk = Cache(os.path.expanduser("~/.cache/tidal-tui"))
+    return _disk
+
+def _disk_call_sync(method, *args, **kwargs):
+    try:
+        return getattr(_disk_cache(), method)(*args, **kwargs)
+    except (sqlite3.Error, OSError, Timeout) as e:
+        # The disk cache is best-effort; a miss just falls through to the network
+        log.warning("disk cache %s failed: %r", method, e)
+        return None
+
+async def _disk_call(method, *args, **kwargs):
+    """Run a diskcache method in a worker thread so SQLite I/O stays off the event loop."""
+    return await asyncio.to_thread(_disk_call_sync, method, *args, **kwargs)
+
+def _cached_search(fn):
+    """Memoize an async search function by its normalized query string."""
+    @wraps(fn)
+    async def wrapper(session, q):
+        q = " ".join(q.split()).lower()
+        key = (fn.__name__, q)
+        result = _search_cache.get(key)
+        if result is not None:
+            return result
+        result = await _disk_call("get", key)
+        if result is None:
+            result = await fn(session, q)
+            await _disk_call("set", key, result, expire=SEARCH_DISK_TTL)
+        _search_cache[key] = result
+        return result
+    return wrapper
+
+async def _get_json(session: aiohttp.ClientSession, path, params):
+    async with _net_sem, session.get(f"{API_URL}{path}", params=params) as r:
+        return orjson.loads(await r.read())
+
+@_cached_search
+async def search_song(session: aiohttp.ClientSession, q):
+    return (await _get_json(session, "/search", {"s": q}))["data"]["items"]
+
+@_cached_search
+async def search_playlist(session: aiohttp.ClientSession, q):
+    return (await _get_json(session, "/search", {"p": q}))["data"]["items"]
+
+@_cached_search
+async def search_artist(session: aiohttp.ClientSession, q):
+    return (await _get_json(session, "/search", {"a": q}))["data"]["artists"]["items"]
+
+async def get_stream_url(session: aiohttp.ClientSession, song_id):
+    url = _url_cache.get(song_id)
+    if url is not None:
+        return url
+    # Disk hits stay out of _url_cache: a fresh in-memory TTL would outlive the signed URL
+    url = await _disk_call("get", ("url", song_id))
+    if url is not None:
+        return url
+    manifest = (await _get_json(session, "/track", {"id": song_id, "quality": "LOSSLESS"}))["data"]["manifest"]
+    url = orjson.loads(base64.b64decode(manifest))["urls"][0]
+    _url_cache[song_id] = url
+    # Same lifetime as the in-memory entry; the URL is signed and expires server-side
+    await _disk_call("set", ("url", song_id), url, expire=_url_cache.ttl)
+    return url
+
+async def invalidate_stream_url(song_id):
+    _url_cache.pop(song_id, None)
+    await _disk_call("delete", ("url", song_id))
+
+# The following lines are removed to make this file a module
+# song_id = search_song("the sound of silence simon and garfunkel")[0]
+# print(song_id)
+# song_id = song_id["id"]
+# print(play_song(song_id))
+# input()
@@ -2,13 +2,19 @@ from textual.app import App, ComposeResult
 from textual.widgets import Header, Footer, Input, Button, Static, Label, ProgressBar
 from textual.containers import Container, VerticalScroll, Horizontal, Vertical
 from textual.message import Message
-from textual.events import Event, MouseDown
-import requests
-import base64
-import json
-import mpv
-from mpv import MPV # Explicitly import MPV class
-from main import search_song, search_playlist, search_artist, play_song
+from textual.events import MouseDown
+from textual.css.query import NoMatches
+import asyncio
+import threading
+import time
+from collections import deque
+from mpv import MPV, MpvEventEndFile # Explicitly import MPV class
+from api import API_ERRORS, search_song, search_playlist, search_artist, get_stream_url, invalidate_stream_url, create_session, close_session
+
+# Label formatters, bound once so building a list of labels is a plain str.format call per item
+_RESULT_LABEL = "[bold]{}. {}[/bold] - [italic]{}[/italic]".format
+_ARTIST_LABEL = "[bold]{}. {}[/bold]".format
+_QUEUE_LABEL = "{}. {} - {}".format
 
 class ResultClick(Message):
     """Custom message for when a result item is clicked or a menu action is chosen."""
@@ -20,6 +26,9 @@ class ResultClick(Message):
         self.item_data = item_data
         self.index = index
 
+class MpvChanged(Message):
+    """Posted from the mpv thread when property changes are waiting to be applied."""
+
 class ContextMenu(Static):
     """A minimal context menu."""
     def __init__(self, item_id: str, item_type: str, item_data: dict, options: list, index: int = -1, **kwargs):
@@ -37,6 +46,8 @@ class ContextMenu(Static):
     def on_button_pressed(self, event: Button.Pressed) -> None:
         action = str(event.button.id)
         self.post_message(ResultClick(self.item_id, self.item_type, action, self.item_data, self.index))
+        if self.app._current_menu is self:
+            self.app._current_menu = None
         self.remove()
 
 class ClickableStatic(Static):
@@ -84,56 +95,120 @@ class MusicPlayerTUI(App):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.player = MPV(ytdl=True, video=False, idle=True, input_default_bindings=True, input_vo_keyboard=True)
+        self.player = None # MPV instance, created on first playback by _ensure_player
         self.is_paused = False
         self.is_playing = False
         self.search_type = "song" # Default search type
         self.song_results_data = []
         self.playlist_results_data = []
         self.artist_results_data = []
+        self.results_query = None # Query the *_results_data above belong to
+        self._result_pool = [] # ClickableStatic widgets in #results_container, reused across searches
+        self._current_menu = None # The open ContextMenu, if any
         self.queue = [] # List of song objects
+        self._queue_widgets = [] # QueueItem widgets, kept parallel to self.queue
         self.history = [] # For previous song support
         self.current_song_data = None
-
-        # Observe properties for playback state
-        self.player.observe_property('pause', self.mpv_property_change)
-        self.player.observe_property('idle-active', self.mpv_property_change)
-        self.player.observe_property('time-pos', self.mpv_property_change)
-        self.player.observe_property('duration', self.mpv_property_change)
+        self.http = None # aiohttp.ClientSession, created in on_mount
+        self._last_pos_push = 0.0 # monotonic time of the last progress bar update
+        self._mpv_inbox = deque() # (name, value) property changes from the mpv thread
+        self._mpv_lock = threading.Lock()
+        self._drain_scheduled = False
+        self._playing_id = None # Track id of the URL last handed to mpv
 
     def on_mount(self) -> None:
         """Called when the app is mounted."""
-        pass
+        self.http = create_session()
+
+    async def on_unmount(self) -> None:
+        """Called when the app shuts down, however it exits."""
+        await close_session(self.http)
+
+    def _ensure_player(self) -> MPV:
+        """Return the mpv player, creating it on first use so libmpv init doesn't delay startup."""
+        if self.player is None:
+            self.player = MPV(ytdl=True, video=False, idle=True, input_default_bindings=True, input_vo_keyboard=True)
+
+            # Observe properties for playback state
+            self.player.observe_property('pause', self.mpv_property_change)
+            self.player.observe_property('idle-active', self.mpv_property_change)
+            self.player.observe_property('time-pos', self.mpv_property_change)
+            self.player.observe_property('duration', self.mpv_property_change)
+            self.player.event_callback('end-file')(self.mpv_end_file)
+        return self.player
 
     def mpv_property_change(self, name, value):
-        """Callback for observed mpv properties (runs in a separate thread)."""
-        if name == 'pause':
-            self.is_paused = value
-        elif name == 'idle-active':
-            if value and self.is_playing:
-                self.call_from_thread(self.action_next_song)
-            self.is_playing = not value
-        elif name == 'time-pos':
-            if value is not None:
-                self.call_from_thread(self.update_progress, value)
-        elif name == 'duration':
-            if value is not None:
-                self.call_from_thread(self.set_duration, value)
-        
-        try:
-            self.call_from_thread(self.update_playback_status)
-        except RuntimeError:
-            pass # App might be shutting down
-    
+        """Callback for observed mpv properties (runs in a separate thread).
+
+        Changes are queued and applied together by _drain_mpv on the UI thread,
+        so a burst of changes costs a single cross-thread hop.
+        """
+        if name == 'time-pos':
+            # mpv reports this many times a second; ~4 Hz is plenty for the progress bar
+            now = time.monotonic()
+            if value is None or now - self._last_pos_push < 0.25:
+                return
+            self._last_pos_push = now
+        self._queue_mpv_change(name, value)
+
+    def mpv_end_file(self, event):
+        """Callback for mpv end-file events (runs in a separate thread)."""
+        if event.data.reason == MpvEventEndFile.ERROR:
+            # The cached URL may have expired; capture the id mpv was playing before another play replaces it
+            self._queue_mpv_change('end-file-error', self._playing_id)
+
+    def _queue_mpv_change(self, name, value):
+        """Hand a change from the mpv thread to _drain_mpv on the UI thread."""
+        with self._mpv_lock:
+            self._mpv_inbox.append((name, value))
+            if self._drain_scheduled:
+                return
+            self._drain_scheduled = True
+        self.post_message(MpvChanged())
+
+    def on_mpv_changed(self, message: MpvChanged) -> None:
+        self._drain_mpv()
+
+    def _drain_mpv(self):
+        """Apply every queued mpv change."""
+        with self._mpv_lock:
+            changes = list(self._mpv_inbox)
+            self._mpv_inbox.clear()
+            self._drain_scheduled = False
+
+        status_changed = False
+        for name, value in changes:
+            if name == 'pause':
+                self.is_paused = value
+                status_changed = True
+            elif name == 'idle-active':
+                if value and self.is_playing:
+                    self.action_next_song()
+                self.is_playing = not value
+                status_changed = True
+            elif name == 'time-pos':
+                self.update_progress(value)
+            elif name == 'duration':
+                if value is not None:
+                    self.set_duration(value)
+                status_changed = True # New song loaded
+            elif name == 'end-file-error':
+                if value is not None:
+                    self.run_worker(invalidate_stream_url(value), group="cache")
+        if status_changed:
+            self.update_playback_status()
+
     def set_duration(self, value):
         try:
             self.query_one("#playback_progress", ProgressBar).total = value
-        except: pass
+        except NoMatches:
+            pass # Not mounted yet, or already torn down
 
     def update_progress(self, value):
         try:
             self.query_one("#playback_progress", ProgressBar).progress = value
-        except: pass
+        except NoMatches:
+            pass
 
     def update_playback_status(self):
         status_bar = self.query_one("#status_bar", Static)
@@ -197,7 +272,7 @@ class MusicPlayerTUI(App):
         if self.queue:
             next_song = self.queue.pop(0)
             self.play_selected_item(next_song['id'], "song", next_song)
-            self.update_queue_display()
+            self._apply_queue_op("remove", 0)
         else:
             self.current_song_data = None
             self.action_stop_playback()
@@ -207,13 +282,13 @@ class MusicPlayerTUI(App):
         if self.history:
             if self.current_song_data:
                 self.queue.insert(0, self.current_song_data)
+                self._apply_queue_op("insert", 0)
             prev_song = self.history.pop()
             self.play_selected_item(prev_song['id'], "song", prev_song)
-            self.update_queue_display()
 
     def on_input_submitted(self, event: Input.Submitted) -> None:
         if event.input.id == "search_input":
-            self.search(self.search_type)
+            self.search()
 
     def on_button_pressed(self, event: Button.Pressed) -> None:
         if event.button.id == "search_type_button":
@@ -232,23 +307,61 @@ class MusicPlayerTUI(App):
         
         query = input_widget.value
         if query:
-            self.search(self.search_type)
+            if query == self.results_query:
+                # All three result types were fetched together, just switch views
+                self.show_results(self.search_type)
+            else:
+                self.search()
 
-    def search(self, search_type: str) -> None:
+    def search(self) -> None:
         query = self.query_one("#search_input", Input).value
         if not query:
             return
 
-        # Clear previous results
-        results_container = self.query_one("#results_container")
-        results_container.remove_children()
-
-        if search_type == "song":
-            self.search_songs(query)
-        elif search_type == "playlist":
-            self.search_playlists(query)
-        elif search_type == "artist":
-            self.search_artists(query)
+        # Run the search as a worker so network I/O doesn't block the UI
+        self.run_worker(self.prefetch_all(query), exclusive=True)
+
+    async def prefetch_all(self, query: str) -> None:
+        """Fetch songs, playlists and artists concurrently, then show the active type."""
+        songs, playlists, artists = await asyncio.gather(
+            search_song(self.http, query),
+            search_playlist(self.http, query),
+            search_artist(self.http, query),
+            return_exceptions=True,
+        )
+        self.song_results_data = self._search_result("song", songs)
+        self.playlist_results_data = self._search_result("playlist", playlists)
+        self.artist_results_data = self._search_result("artist", artists)
+        # Resolve artist names once here so rendering the results and queue is a plain lookup
+        for item in self.song_results_data + self.playlist_results_data:
+            item['_artist_name'] = self._get_artist_name(item.get('artist', 'Unknown'))
+        self.results_query = query
+        self.show_results(self.search_type)
+        # Pooled widgets keep the old scroll offset; a new result set should start at the top
+        self.query_one("#results_container").scroll_home(animate=False)
+
+    def _search_result(self, search_type: str, result) -> list:
+        """Unwrap one asyncio.gather result; a failed search type just shows no results."""
+        if isinstance(result, API_ERRORS):
+            self.log.warning(f"{search_type} search failed: {result!r}")
+            return []
+        if isinstance(result, BaseException):
+            raise result
+        if not isinstance(result, list):
+            self.log.warning(f"{search_type} search returned {type(result).__name__}, expected a list")
+            return []
+        # Rows without an id can't be played or queued
+        return [item for item in result if isinstance(item, dict) and 'id' in item]
+
+    def show_results(self, search_type: str) -> None:
+        # Refill in one batch so the screen repaints once
+        with self.batch_update():
+            if search_type == "song":
+                self.show_songs()
+            elif search_type == "playlist":
+                self.show_playlists()
+            elif search_type == "artist":
+                self.show_artists()
 
     def _get_artist_name(self, artist_data) -> str:
         """Helper to extract artist name from potentially complex artist data."""
@@ -256,52 +369,54 @@ class MusicPlayerTUI(App):
             return artist_data.get('name', 'Unknown Artist')
         return str(artist_data)
 
-    def search_songs(self, query: str) -> None:
-        try:
-            songs = search_song(query) # Using the imported function
-            self.song_results_data = songs # Store full song objects
-            results_container = self.query_one("#results_container")
-            if songs:
-                for i, song in enumerate(songs):
-                    artist_name = self._get_artist_name(song.get('artist', 'Unknown'))
-                    # Using Rich markup for better looking list items
-                    label = f"[bold]{i+1}. {song['title']}[/bold] - [italic]{artist_name}[/italic]"
-                    results_container.mount(ClickableStatic(label, item_id=song['id'], item_type="song", item_data=song))
-        except: pass
-
-    def search_playlists(self, query: str) -> None:
-        try:
-            playlists = search_playlist(query) # Using the imported function
-            self.playlist_results_data = playlists # Store full playlist objects
-            results_container = self.query_one("#results_container")
-            if playlists:
-                for i, pl in enumerate(playlists):
-                    artist_name = self._get_artist_name(pl.get('artist', 'Unknown'))
-                    # Using Rich markup for better looking list items
-                    label = f"[bold]{i+1}. {pl.get('title', 'Unknown Title')}[/bold] - [italic]{artist_name}[/italic]"
-                    results_container.mount(ClickableStatic(label, item_id=pl['id'], item_type="playlist", item_data=pl))
-        except: pass
-
-    def search_artists(self, query: str) -> None:
-        try:
-            artists = search_artist(query) # Using the imported function
-            self.artist_results_data = artists # Store full artist objects
-            results_container = self.query_one("#results_container")
-            if artists:
-                for i, artist in enumerate(artists):
-                    # Using Rich markup for better looking list items
-                    label = f"[bold]{i+1}. {artist.get('name', 'Unknown Artist')}[/bold]"
-                    results_container.mount(ClickableStatic(label, item_id=artist['id'], item_type="artist", item_data=artist))
-        except: pass
+    def _fill_results(self, item_type: str, items: list, labels: list) -> None:
+        """Show items in the results list, reusing pooled ClickableStatic widgets.
+
+        Widgets are only created when there are more results than ever before;
+        leftover ones are hidden rather than removed.
+        """
+        pool = self._result_pool
+        for widget, label, item in zip(pool, labels, items):
+            widget.update(label)
+            widget.item_id = item['id']
+            widget.item_type = item_type
+            widget.item_data = item
+            widget.display = True
+        for widget in pool[len(items):]:
+            widget.display = False
+        extra = [ClickableStatic(label, item_id=item['id'], item_type=item_type, item_data=item) for label, item in zip(labels[len(pool):], items[len(pool):])]
+        if extra:
+            self.query_one("#results_container").mount_all(extra)
+            pool.extend(extra)
+
+    def show_songs(self) -> None:
+        songs = self.song_results_data
+        # Using Rich markup for better looking list items
+        labels = [_RESULT_LABEL(i, song.get('title', 'Unknown Title'), song['_artist_name']) for i, song in enumerate(songs, 1)]
+        self._fill_results("song", songs, labels)
+
+    def show_playlists(self) -> None:
+        playlists = self.playlist_results_data
+        # Using Rich markup for better looking list items
+        labels = [_RESULT_LABEL(i, pl.get('title', 'Unknown Title'), pl['_artist_name']) for i, pl in enumerate(playlists, 1)]
+        self._fill_results("playlist", playlists, labels)
+
+    def show_artists(self) -> None:
+        artists = self.artist_results_data
+        # Using Rich markup for better looking list items
+        labels = [_ARTIST_LABEL(i, artist.get('name', 'Unknown Artist')) for i, artist in enumerate(artists, 1)]
+        self._fill_results("artist", artists, labels)
 
     def show_context_menu(self, item_id: str, item_type: str, item_data: dict, options: list, x: int, y: int, index: int = -1):
         """Show context menu at coordinates."""
         # Remove existing if any
-        for node in self.query("ContextMenu"):
-            node.remove()
+        if self._current_menu:
+            self._current_menu.remove()
+            self._current_menu = None
         
         menu = ContextMenu(item_id, item_type, item_data, options, index)
         self.mount(menu)
+        self._current_menu = menu
         menu.styles.offset = (x, y)
         menu.focus()
 
@@ -312,39 +427,81 @@ class MusicPlayerTUI(App):
         elif message.action == "queue":
             if message.item_type == "song":
                 self.queue.append(message.item_data)
-                self.update_queue_display()
+                self._apply_queue_op("insert", len(self.queue) - 1)
         elif message.action == "play_next":
             if message.item_type == "song":
                 self.queue.insert(0, message.item_data)
-                self.update_queue_display()
+                self._apply_queue_op("insert", 0)
         elif message.action == "remove":
             if 0 <= message.index < len(self.queue):
                 self.queue.pop(message.index)
-                self.update_queue_display()
+                self._apply_queue_op("remove", message.index)
         elif message.action == "move_up":
             if 0 < message.index < len(self.queue):
                 self.queue[message.index], self.queue[message.index-1] = self.queue[message.index-1], self.queue[message.index]
-                self.update_queue_display()
+                self._apply_queue_op("swap", message.index - 1)
         elif message.action == "move_down":
             if 0 <= message.index < len(self.queue) - 1:
                 self.queue[message.index], self.queue[message.index+1] = self.queue[message.index+1], self.queue[message.index]
-                self.update_queue_display()
-
-    def update_queue_display(self):
-        """Update the queue list view."""
-        queue_list = self.query_one("#queue_list", VerticalScroll)
-        queue_list.remove_children()
-        for i, song in enumerate(self.queue):
-            artist_name = self._get_artist_name(song.get('artist', 'Unknown'))
-            queue_list.mount(QueueItem(f"{i+1}. {song['title']} - {artist_name}", item_data=song, index=i, classes="queue_item"))
+                self._apply_queue_op("swap", message.index)
+
+    def _queue_label(self, i: int, song: dict) -> str:
+        return _QUEUE_LABEL(i + 1, song['title'], song['_artist_name'])
+
+    def _refresh_queue_items(self, start: int, stop: int = None):
+        """Re-sync index, data and label of the queue widgets in [start, stop)."""
+        stop = len(self._queue_widgets) if stop is None else stop
+        for i in range(start, stop):
+            widget = self._queue_widgets[i]
+            widget.index = i
+            widget.item_data = self.queue[i]
+            widget.update(self._queue_label(i, self.queue[i]))
+
+    def _apply_queue_op(self, action: str, index: int):
+        """Mirror a single change to self.queue onto the queue list view.
+
+        "insert" and "remove" refer to position index, "swap" to index and index+1.
+        Only the widgets whose position changed are touched.
+        """
+        if action == "insert":
+            song = self.queue[index]
+            widget = QueueItem(self._queue_label(index, song), item_data=song, index=index, classes="queue_item")
+            queue_list = self.query_one("#queue_list", VerticalScroll)
+            if index < len(self._queue_widgets):
+                queue_list.mount(widget, before=self._queue_widgets[index])
+            else:
+                queue_list.mount(widget)
+            self._queue_widgets.insert(index, widget)
+            self._refresh_queue_items(index + 1)
+        elif action == "remove":
+            self._queue_widgets.pop(index).remove()
+            self._refresh_queue_items(index)
+        elif action == "swap":
+            self._refresh_queue_items(index, index + 2)
 
     def play_selected_item(self, item_id: str, item_type: str, item_data: dict = None) -> None:
+        if item_type == "song":
+            self.current_song_data = item_data
+            self.run_worker(self._play_song(item_id), group="playback", exclusive=True)
+
+    async def _play_song(self, item_id: str) -> None:
         try:
-            if item_type == "song":
-                self.current_song_data = item_data
-                play_song(item_id, self.player) # Using the imported function
-        except Exception as e:
+            url = await get_stream_url(self.http, item_id)
+        except API_ERRORS as e:
             self.query_one("#status_bar", Static).update(f"Error: {e}")
+            return
+        # Record the id before mpv can report an error for this URL
+        self._playing_id = item_id
+        self._ensure_player().play(url)
+        if self.queue:
+            # Resolve the next song's stream URL now so skipping to it doesn't wait on the network
+            self.run_worker(self._prefetch_url(self.queue[0]['id']), group="prefetch", exclusive=True)
+
+    async def _prefetch_url(self, item_id: str) -> None:
+        try:
+            await get_stream_url(self.http, item_id)
+        except API_ERRORS:
+            pass # It will simply be fetched again when played
 
 
 if __name__ == "__main__":